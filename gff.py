@@ -3,8 +3,31 @@ gff.py
 
 contains Gff class
 #################################################################################################"""
+import io
+import json
+import mmap
+import os
 import sys
 import re
+from concurrent.futures import ProcessPoolExecutor
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import islice
+
+
+# marks a column that is absent from a row, distinct from any stored value including None
+_missing = object()
+
+
+def _mixed_order(value):
+    """---------------------------------------------------------------------------------------------
+    sort key for column values that may mix numbers and strings, e.g., begin or frame where
+    missing values are '.'. numbers sort before strings, each in their usual order
+
+    :param value: int, float, or str
+    :return: tuple
+    ---------------------------------------------------------------------------------------------"""
+    return isinstance(value, str), value
 
 
 class Dotdict(dict):
@@ -25,6 +48,8 @@ class Gff:
 
     column = ['sequence', 'method', 'feature', 'begin', 'end', 'score', 'strand', 'frame',
               'attribute']
+    buffer_size = 1 << 20
+    read_size = 16 << 20
 
     def __init__(self, file="", mode="GFF"):
         """-----------------------------------------------------------------------------------------
@@ -34,6 +59,8 @@ class Gff:
 
         data: list of dicts
         gff_in: filehandle for gff file
+        _idx: inverted indices, column name: {value: [row numbers]}, see index()
+        _idx_rows: number of rows in data when the indices were built
         attr_sep: the inner separator for attributes. key-value pairs are separated by ; and the
             keys and values separated by attr_sep
 
@@ -42,6 +69,8 @@ class Gff:
         -----------------------------------------------------------------------------------------"""
         self.data = []
         self.gff_in = None
+        self._idx = {}
+        self._idx_rows = 0
         self.mode = 'GFF'
         self.attr_sep = '='
         self.setmode(mode)
@@ -51,22 +80,53 @@ class Gff:
 
     def open(self, file):
         """-----------------------------------------------------------------------------------------
-        safely open a file for reading
+        safely open a file for reading. Files are read with a large buffer, and where the OS
+        supports it the kernel is told the file will be read sequentially so it reads ahead more
+        aggressively on large, uncached files. GFF/GTF files are ASCII, they are decoded as UTF-8
+        (which has a fast path for ASCII) rather than with the locale's encoding
 
         :param self: gff
         :param file: str, path to a GFF file
         :return: fh or False if unsuccessful
         -----------------------------------------------------------------------------------------"""
         try:
-            fh = open(file, 'r')
+            fh = open(file, 'r', buffering=Gff.buffer_size, encoding='utf-8')
 
         except IOError:
             sys.stderr.write("gff.open unable to open GFF file ({})".format(file))
             exit(1)
 
+        if hasattr(os, 'posix_fadvise'):
+            try:
+                os.posix_fadvise(fh.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            except OSError:
+                # advice is optional, e.g., not supported for pipes
+                pass
+
         self.gff_in = fh
         return fh
 
+    @property
+    def attr_sep(self):
+        """-----------------------------------------------------------------------------------------
+        separator between attribute keys and values, '=' for GFF and ' ' for GTF
+
+        :return: string
+        -----------------------------------------------------------------------------------------"""
+        return self._attr_sep
+
+    @attr_sep.setter
+    def attr_sep(self, sep):
+        """-----------------------------------------------------------------------------------------
+        setting the separator also rebuilds feature_parse() and the attribute splitter for the new
+        separator (see _make_parser())
+
+        :param sep: string      new attribute separator
+        :return: None
+        -----------------------------------------------------------------------------------------"""
+        self._attr_sep = sep
+        self.feature_parse, self._attribute_split = self._make_parser()
+
     def setmode(self, mode):
         """-----------------------------------------------------------------------------------------
         changing from GFF to GTF mode requires changing the attribute separator self.attr_set
@@ -75,12 +135,12 @@ class Gff:
         -----------------------------------------------------------------------------------------"""
         if self.mode == mode:
             # correct mode is already set
-            return
+            return self.mode
         elif mode == 'GFF':
-            self.mode == 'GFF'
+            self.mode = 'GFF'
             self.attr_sep = '='
         elif mode == 'GTF':
-            self.mode == 'GTF'
+            self.mode = 'GTF'
             self.attr_sep = ' '
         else:
             sys.stderr.write(f'gff.setmode - unknown mode ({mode}), mode is {self.mode}')
@@ -98,19 +158,45 @@ class Gff:
         :param end: int         last row to modify + 1
         :return: int            number of rows modified
         -----------------------------------------------------------------------------------------"""
+        data = self.data
         if end == 0:
-            end = len(self.data)
+            end = len(data)
+        if begin >= end:
+            return 0
 
         # check that attr is unique
-        if attr in self.data[begin]:
+        if attr in data[begin]:
             sys.stderr.write(f'Gff.attribute_add - attribute ({attr}) already exists in Gff.data')
             return 0
 
-        for row in self.data[begin:end]:
+        self._idx.pop(attr, None)
+        # islice walks the rows in place, a slice would first copy the row references
+        for row in islice(data, begin, end):
             row[attr] = value
 
         return end - begin
 
+    def attribute_parse(self, begin=0, end=0):
+        """-----------------------------------------------------------------------------------------
+        Split the attribute column into separate key-value entries for rows that were read with
+        attributes=False, or with only some attributes. if begin and end are not provided, every row
+        is parsed. The current attr_sep is used, so parse before changing the mode with setmode().
+
+        :param begin: int       first row
+        :param end: int         last row to modify + 1
+        :return: int            number of rows parsed
+        -----------------------------------------------------------------------------------------"""
+        if end == 0:
+            end = len(self.data)
+
+        # attribute keys are not known until parsed, so all indices may be stale
+        self._idx = {}
+        attribute_split = self._attribute_split
+        for row in islice(self.data, begin, end):
+            attribute_split(row)
+
+        return end - begin
+
     def read(self):
         """-----------------------------------------------------------------------------------------
         Read a line from gff_in and delegate to the proper parsing function
@@ -131,75 +217,316 @@ class Gff:
             # EOF
             return False
 
-    def read_all(self):
+    def read_all(self, attributes=True):
         """-----------------------------------------------------------------------------------------
-        read the entire file, all features, into self.data. lines are parsed.
+        read the entire file, all features, into self.data. lines are parsed. The file is read in
+        blocks of Gff.read_size characters and split into lines in bulk, rather than calling read()
+        for each line. Blank lines are skipped.
 
+        :param attributes: boolean, if False the attribute column is kept only as a string, use
+            attribute_parse() to split it later. May also be a list of the attribute keys to keep
         :return: int, number of lines read
         -----------------------------------------------------------------------------------------"""
+        if not isinstance(attributes, bool):
+            attributes = frozenset(attributes)
+
+        data = self.data
+        feature_parse = self.feature_parse
+        read = self.gff_in.read
+
         nline = 0
-        while self.read():
+        tail = ''
+        while True:
+            block = read(Gff.read_size)
+            if not block:
+                break
+
+            lines = (tail + block).split('\n')
+            # the last line may be incomplete, keep it for the next block
+            tail = lines.pop()
+            for line in lines:
+                line = line.rstrip()
+                if not line:
+                    continue
+
+                if line.startswith('#'):
+                    self.comment_parse()
+                else:
+                    data.append(feature_parse(line, attributes))
+                nline += 1
+
+        # final line without a newline
+        tail = tail.rstrip()
+        if tail:
+            if tail.startswith('#'):
+                self.comment_parse()
+            else:
+                data.append(feature_parse(tail, attributes))
             nline += 1
 
         return nline
 
-    def read_feature(self, feature_list):
+    def read_feature(self, feature_list, attributes=True, workers=1, cache=''):
         """-----------------------------------------------------------------------------------------
-        Read the whole file and store only features in feature_list in self.data
-
-        :param feature_list:
+        Read the whole file and store only features in feature_list in self.data. The feature column
+        is checked before the line is parsed so unwanted lines are never fully parsed.
+
+        If a cache file is given, the parsed rows are saved to it (JSON format) and later reads
+        of the same, unchanged, file with the same features, attributes and mode load the rows from
+        the cache instead of parsing the file again. A cache that does not match is overwritten.
+        Loading JSON cannot run code, but the rows are taken from the cache as they are, so the
+        cache should be no more writable by others than the input file itself.
+
+        With more than one worker, the file is divided into byte ranges that end at line breaks and
+        the ranges are parsed in separate processes. This only pays off for large files since the
+        parsed rows must be copied back from the workers. The whole file is read, regardless of
+        what has already been read from gff_in, and gff_in is left at end of file.
+
+        :param feature_list: list of str, or a single feature as str
+        :param attributes: boolean, if False the attribute column is kept only as a string, use
+            attribute_parse() to split it later. May also be a list of the attribute keys to keep
+        :param workers: int, number of processes, None for one per cpu
+        :param cache: str, path to cache file, no caching if empty
         :return: int, number of features read
         -----------------------------------------------------------------------------------------"""
+        if isinstance(feature_list, str):
+            feature_list = [feature_list]
+        features = frozenset(feature_list)
+        if not isinstance(attributes, bool):
+            attributes = frozenset(attributes)
+
+        if cache:
+            key = self._cache_key(features, attributes)
+            if key is None:
+                sys.stderr.write(f'Gff.read_feature - input is not a file, cache ({cache}) not '
+                                 f'used\n')
+            else:
+                rows = self._cache_load(cache, key)
+                if rows is not None:
+                    self.data.extend(rows)
+                    self.gff_in.seek(0, io.SEEK_END)
+                    return len(rows)
+
+                start = len(self.data)
+                count = self.read_feature(features, attributes, workers)
+                self._cache_save(cache, key, self.data[start:])
+                return count
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers > 1:
+            return self._read_feature_parallel(features, attributes, workers)
+
+        data = self.data
+        feature_parse = self.feature_parse
         count = 0
         for line in self.gff_in:
-            if line:
-                if line.startswith('#'):
-                    self.comment_parse()
+            if line.startswith('#'):
+                self.comment_parse()
 
-                else:
-                    parsed = self.feature_parse(line)
-                    if parsed['feature'] in feature_list:
-                        self.data.append(parsed)
-                        count += 1
+            else:
+                # only the first three columns are needed to select the feature. split the same
+                # way as feature_parse(), on tabs with a fallback to whitespace
+                field = line.split('\t', 3)
+                if len(field) < 4:
+                    field = line.split(maxsplit=3)
+                if len(field) > 2 and field[2] in features:
+                    data.append(feature_parse(line.rstrip(), attributes))
+                    count += 1
 
         return count
 
-    def feature_parse(self, line):
+    def _cache_key(self, features, attributes):
         """-----------------------------------------------------------------------------------------
-        parse a feature line. the final field holds attributes in key value format. for GFF,
-        the format is
-        Parent=maker-Ctg0001-augustus-gene-0.4;ID=maker-Ctg0001-augustus-gene-0.4.mRNA1;Name=maker-Ctg0001-augustus-gene-0.4.mRNA1;Alias=maker-Ctg0001-augustus-gene-0.4,maker-Ctg0001-augustus-gene-0.4-mRNA-1;mRNA=maker-Ctg0001-augustus-gene-0.4.mRNA1;coge_fid=936743213
-        for GTF is is
-        gene_id "MSTRG.13"; transcript_id "MSTRG.13.3"; exon_number "1";
+        Identify the input and the read_feature() options a cache file was written for. The file is
+        identified by its path, size, and modification time.
 
-        :return:
+        :param features: frozenset of str, features to keep
+        :param attributes: boolean or frozenset, see read_feature()
+        :return: list, JSON compatible so it compares equal to the key read back from a cache, or
+            None if gff_in is not a named file, e.g., a StringIO
+        -----------------------------------------------------------------------------------------"""
+        name = getattr(self.gff_in, 'name', None)
+        if not isinstance(name, str):
+            return None
+        try:
+            stat = os.stat(name)
+        except OSError:
+            return None
+        if not isinstance(attributes, bool):
+            attributes = sorted(attributes)
+
+        return [os.path.abspath(name), stat.st_size, stat.st_mtime_ns,
+                sorted(features), attributes, self.attr_sep]
+
+    @staticmethod
+    def _cache_load(cache, key):
+        """-----------------------------------------------------------------------------------------
+        Load rows saved by _cache_save() if the cache exists and was written for key. The first
+        line of the cache is the key, the rest is the list of rows. As in feature_parse(), the
+        sequence, method, and feature columns are interned.
+
+        :param cache: str, path to cache file
+        :param key: list, from _cache_key()
+        :return: list of Dotdict, or None if the cache is missing, unreadable, or does not match
         -----------------------------------------------------------------------------------------"""
-        field = line.rstrip().split(maxsplit=8)
-        parsed = {}
-        for i in range(len(field)):
-            # extract the 9 defined columns
-            parsed[Gff.column[i]] = field[i]
+        intern = sys.intern
+        try:
+            with open(cache, 'r', buffering=Gff.buffer_size, encoding='utf-8') as fh:
+                if json.loads(fh.readline()) != key:
+                    return None
 
-        # set numerical fields to int
-        for col in ('begin', 'end', 'frame'):
-            if parsed[col] != '.':
-                parsed[col] = int(parsed[col])
-        # parsed['score'] = float(parsed['score']) # score is usually '.'
+                rows = json.load(fh, object_hook=Dotdict)
+                for row in rows:
+                    row['sequence'] = intern(row['sequence'])
+                    row['method'] = intern(row['method'])
+                    row['feature'] = intern(row['feature'])
 
-        # split the attributes on ; and restore as a hash
+                return rows
 
-        field = parsed['attribute'].rstrip().split(';')
-        # attribute may end in; so last field may be blank
-        if not field[-1]:
-            field.pop()
+        except (OSError, ValueError, TypeError, KeyError):
+            # ValueError includes malformed JSON and undecodable bytes
+            return None
 
-        for f in field:
-            (key, value) = f.strip().split(self.attr_sep, maxsplit=1)
-            parsed[key] = value.replace('"', '')
+    @staticmethod
+    def _cache_save(cache, key, rows):
+        """-----------------------------------------------------------------------------------------
+        Save rows to the cache file, preceded by key. Failure to write the cache is reported but
+        is not an error.
+
+        :param cache: str, path to cache file
+        :param key: list, from _cache_key()
+        :param rows: list of Dotdict, parsed rows
+        :return: bool, True if the cache was written
+        -----------------------------------------------------------------------------------------"""
+        try:
+            with open(cache, 'w', buffering=Gff.buffer_size, encoding='utf-8') as fh:
+                fh.write(json.dumps(key))
+                fh.write('\n')
+                # dumps() encodes in C, dump() would encode in python to write in pieces
+                fh.write(json.dumps(rows, separators=(',', ':')))
+
+        except OSError:
+            sys.stderr.write(f'Gff.read_feature - unable to write cache file ({cache})\n')
+            return False
+
+        return True
+
+    def _read_feature_parallel(self, features, attributes, workers):
+        """-----------------------------------------------------------------------------------------
+        Parallel version of read_feature(), see read_feature() for usage. Each worker parses one
+        byte range of the file with _read_feature_range().
+
+        :param features: frozenset of str, features to keep
+        :param attributes: boolean or frozenset, see read_feature()
+        :param workers: int, number of processes
+        :return: int, number of features read
+        -----------------------------------------------------------------------------------------"""
+        path = self.gff_in.name
+
+        # range boundaries are moved forward to the start of the next line
+        bound = [0]
+        with open(path, 'rb') as fh:
+            size = os.fstat(fh.fileno()).st_size
+            if size:
+                with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    for k in range(1, workers):
+                        eol = mm.find(b'\n', max(k * size // workers, bound[-1]))
+                        bound.append(size if eol == -1 else eol + 1)
+        bound.append(size)
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            jobs = [pool.submit(_read_feature_range, path, bound[k], bound[k + 1], features,
+                                self.attr_sep, attributes)
+                    for k in range(workers) if bound[k] < bound[k + 1]]
+            count = 0
+            for job in jobs:
+                # results are collected in file order
+                rows = job.result()
+                self.data.extend(rows)
+                count += len(rows)
+
+        self.gff_in.seek(0, io.SEEK_END)
+        return count
 
-        # self.data.append(parsed)
+    def _make_parser(self):
+        """-----------------------------------------------------------------------------------------
+        Build the line parser and attribute splitter for the current attribute separator. The mode
+        is fixed for a whole file, so the column names, the separator and the functions used for
+        every line are bound once, as closure variables, rather than looked up on self, Gff, and
+        sys for each line. Called whenever attr_sep is set, the results are stored as
+        self.feature_parse and self._attribute_split.
 
-        return parsed
+        :return: function, function     feature_parse(line), attribute_split(row)
+        -----------------------------------------------------------------------------------------"""
+        column = tuple(Gff.column)
+        sep = self._attr_sep
+        intern = sys.intern
+
+        def attribute_split(row, keys=True):
+            """-------------------------------------------------------------------------------------
+            split the attribute column of row into key-value pairs stored in row. Pairs are
+            separated by ; and the key and value by attr_sep, quotes are removed from the values.
+
+            :param row: dict            parsed row with an attribute column
+            :param keys: bool or set    True for all attributes, or the keys to keep
+            :return: dict               row
+            -------------------------------------------------------------------------------------"""
+            for field in row['attribute'].split(';'):
+                key, found, value = field.strip().partition(sep)
+                if found and (keys is True or key in keys):
+                    row[key] = value.replace('"', '')
+
+            return row
+
+        def feature_parse(line, attributes=True):
+            """-------------------------------------------------------------------------------------
+            parse a feature line, the trailing newline should already be removed. the final field
+            holds attributes in key value format. for GFF, the format is
+            Parent=maker-Ctg0001-augustus-gene-0.4;ID=maker-Ctg0001-augustus-gene-0.4.mRNA1;Name=maker-Ctg0001-augustus-gene-0.4.mRNA1;Alias=maker-Ctg0001-augustus-gene-0.4,maker-Ctg0001-augustus-gene-0.4-mRNA-1;mRNA=maker-Ctg0001-augustus-gene-0.4.mRNA1;coge_fid=936743213
+            for GTF is is
+            gene_id "MSTRG.13"; transcript_id "MSTRG.13.3"; exon_number "1";
+
+            :param line: str            one feature line
+            :param attributes: bool     if False, do not split the attribute column, may also be
+                                        a set of the attribute keys to keep
+            :return: Dotdict            columns and attributes of the feature
+            -------------------------------------------------------------------------------------"""
+            # columns are tab delimited, but fall back to splitting on whitespace for files where
+            # the tabs have been converted to spaces
+            field = line.split('\t', 8)
+            if len(field) < 9:
+                field = line.split(maxsplit=8)
+
+            # sequence, method and feature are interned to save memory, rows share one string each
+            field[0] = intern(field[0])
+            field[1] = intern(field[1])
+            field[2] = intern(field[2])
+
+            # set numerical fields, begin, end, and frame, to int unless they are '.'. score is
+            # usually '.' and is left as a string
+            value = field[3]
+            if value != '.':
+                field[3] = int(value)
+            value = field[4]
+            if value != '.':
+                field[4] = int(value)
+            value = field[7]
+            if value != '.':
+                field[7] = int(value)
+
+            # extract the 9 defined columns, dict(zip()) builds the row in C rather than with a
+            # Python loop over the columns. Rows are Dotdicts so they can be returned by the
+            # get_by_* generators without copying
+            parsed = Dotdict(zip(column, field))
+
+            # split the attributes into key-value pairs and store as a hash
+            if attributes:
+                attribute_split(parsed, attributes)
+
+            return parsed
+
+        return feature_parse, attribute_split
 
     def comment_parse(self):
         """-----------------------------------------------------------------------------------------
@@ -218,10 +545,7 @@ class Gff:
         :param start: int       row on which to start
         :yield: int, Dotdict    row number, next matching entry
         -----------------------------------------------------------------------------------------"""
-        data = self.data
-        for n in range(start, len(data)):
-            if data[n]['feature'] == key:
-                yield n, data[n]
+        yield from self._select('feature', key, start)
 
         return
 
@@ -230,12 +554,80 @@ class Gff:
         Generator for entries that match a specific sequence (column 0)
 
         :param seqid: string        id of sequence
-        :yield: Dotdict             next matching entry
+        :yield: Dotdict             next matching entry, this is the row in data, not a copy
+        -----------------------------------------------------------------------------------------"""
+        for _, row in self._select('sequence', seqid):
+            yield row
+
+        return
+
+    def index(self, column_list=('feature', 'sequence')):
+        """-----------------------------------------------------------------------------------------
+        Build inverted indices, value: [row numbers], for the columns in column_list so that
+        get_by_feature() and get_by_sequence() do not have to scan all of data. Without an index
+        they scan. An index is dropped when the number of rows changes or when the column is
+        modified by a Gff method. If rows are reordered or modified directly, call index() again
+        before querying. A row that no longer matches the index is detected when it is reached,
+        the index is dropped, and the lookup finishes by scanning.
+
+        :param column_list: list of str, predefined or attribute columns
+        :return: int, number of rows indexed
+        -----------------------------------------------------------------------------------------"""
+        data = self.data
+        if self._idx_rows != len(data):
+            # indices for other columns are stale
+            self._idx = {}
+
+        for column in column_list:
+            idx = defaultdict(list)
+            for n, row in enumerate(data):
+                idx[row.get(column)].append(n)
+
+            self._idx[column] = dict(idx)
+
+        self._idx_rows = len(data)
+        return self._idx_rows
+
+    def _select(self, column, key, start=0):
+        """-----------------------------------------------------------------------------------------
+        Generator for the rows, from row start, where column equals key. The index built by
+        index() is used if there is a current one, otherwise the rows are scanned. Rows found
+        through the index are checked before they are yielded, so a stale index never returns a
+        wrong row. Rows are yielded in row order, except that if the index is found to be stale,
+        matching rows it skipped before that point are yielded late.
+
+        :param column: str, predefined or attribute column
+        :param key: str, column value to match
+        :param start: int, row on which to start
+        :yield: int, Dotdict    row number, next matching entry
         -----------------------------------------------------------------------------------------"""
         data = self.data
-        for row in data:
-            if row['sequence'] == seqid:
-                yield Dotdict(row)
+        idx = self._idx.get(column) if self._idx_rows == len(data) else None
+        if idx is not None:
+            rows = idx.get(key, ())
+            first = bisect_left(rows, start)
+            for k in range(first, len(rows)):
+                n = rows[k]
+                row = data[n]
+                if row.get(column) != key:
+                    # rows were reordered or edited after index(). drop the index, yield the
+                    # matching rows before n that it missed, and scan the rest
+                    self._idx.pop(column, None)
+                    found = set(rows[first:k])
+                    for m, earlier in enumerate(islice(data, start, n), start):
+                        if m not in found and earlier.get(column, _missing) == key:
+                            yield m, earlier
+                    start = n
+                    break
+
+                yield n, row
+
+            else:
+                return
+
+        for n, row in enumerate(islice(data, start, None), start):
+            if row.get(column, _missing) == key:
+                yield n, row
 
         return
 
@@ -254,15 +646,62 @@ class Gff:
         if stop == 0:
             stop = len(data)
 
-        for n in range(start, stop):
-            if column not in data[n]:
-                continue
-
-            if data[n][column] == key:
-                yield n, data[n]
+        # rows are examined as the generator advances. rows lacking the column get the private
+        # missing marker, which never equals key, so even key=None only matches stored values
+        missing = _missing
+        for n, row in enumerate(islice(data, start, stop), start):
+            if row.get(column, missing) == key:
+                yield n, row
 
         return
 
+    def columns(self, column_list=None, start=0, stop=0):
+        """-----------------------------------------------------------------------------------------
+        Column (structure of arrays) view of data: a dict of lists, one list per column, with one
+        entry per row. Rows without the column, e.g. rows lacking an attribute, give None. The
+        lists are copies, changes are not reflected in data.
+
+        :param column_list: list, predefined or attribute columns, default is Gff.column
+        :param start: int, beginning row
+        :param stop: int, ending row + 1
+        :return: dict, column name: list of values
+        -----------------------------------------------------------------------------------------"""
+        if column_list is None:
+            column_list = Gff.column
+
+        rows = self.data
+        if start or stop:
+            if stop == 0:
+                stop = len(rows)
+            rows = rows[start:stop]
+
+        cols = {}
+        for column in column_list:
+            cols[column] = [row.get(column) for row in rows]
+
+        return cols
+
+    def factorize(self, column, start=0, stop=0):
+        """-----------------------------------------------------------------------------------------
+        Category codes for a column with few distinct values, such as sequence, strand, or source.
+        Each distinct value is replaced by an int, assigned in sorted order of the values so codes
+        sort the same way as the values. Columns that mix numbers and strings, such as frame with
+        0, 1, 2 and '.', sort the numbers first. Rows without the column get code -1. Comparing and
+        sorting codes is cheaper than comparing strings, and codes of several columns can be
+        combined into a single int key.
+
+        :param column: str, predefined or attribute column
+        :param start: int, beginning row
+        :param stop: int, ending row + 1
+        :return: list of int, list   code for each row, values in code order
+        -----------------------------------------------------------------------------------------"""
+        values = self.columns([column], start, stop)[column]
+        category = sorted(set(values) - {None}, key=_mixed_order)
+        code = {value: n for n, value in enumerate(category)}
+        code[None] = -1
+
+        return [code[value] for value in values], category
+
     def replace_by_column(self, column, find, replace):
         """-----------------------------------------------------------------------------------------
         Replace all of find by replace in column
@@ -273,6 +712,7 @@ class Gff:
         :return: int, rows examined
         -----------------------------------------------------------------------------------------"""
         data = self.data
+        self._idx.pop(column, None)
         n = 0
         for d in data:
             if column in d:
@@ -281,18 +721,66 @@ class Gff:
 
         return n
 
+    def replace_by_column_many(self, column, pairs):
+        """-----------------------------------------------------------------------------------------
+        Make several replacements in column with one pass over data. pairs is a list of
+        (find, replace) strings. The replacements are made simultaneously: text inserted by one
+        replacement is not searched by the others. Where finds overlap, the leftmost match is
+        replaced, and of finds matching at the same position the longest is used, e.g., with
+        [('ab', 'X'), ('bcd', 'Y')] 'abcd' becomes 'Xcd'. For finds that do not interact this
+        gives the same result as calling replace_by_column() once per pair.
+
+        :param column: str, name of a predefined or attribute column
+        :param pairs: list of (str, str), strings to replace and strings to substitute for them
+        :return: int, rows examined
+        -----------------------------------------------------------------------------------------"""
+        replace_map = dict(pairs)
+        finds = sorted((f for f in replace_map if f), key=len, reverse=True)
+        if not finds:
+            return 0
+
+        sub = re.compile('|'.join(map(re.escape, finds))).sub
+
+        def replace(match):
+            return replace_map[match.group(0)]
+
+        data = self.data
+        self._idx.pop(column, None)
+        n = 0
+        for d in data:
+            value = d.get(column)
+            if value is not None:
+                d[column] = sub(replace, value)
+                n += 1
+
+        return n
+
     def replace_columns_re(self, column_list, search, replace=''):
         """-----------------------------------------------------------------------------------------
-        replace strings in a list of columns using a regular expression
+        replace strings in a list of columns using a regular expression. Each column value is
+        substituted separately so that anchors and patterns such as .* cannot match across columns
+
+        :param column_list: list, names of predefined or attribute columns
+        :param search: str, regular expression to find
+        :param replace: str, replacement, may include group references such as \\1
+        :return: int, number of column values examined
         -----------------------------------------------------------------------------------------"""
         data = self.data
         n = 0
 
-        query = re.compile(search)
+        column_list = tuple(column_list)
+        for column in column_list:
+            self._idx.pop(column, None)
+
+        # re.compile() keeps its own bounded cache of recent patterns, so repeated calls with
+        # the same search do not recompile it
+        sub = re.compile(search).sub
         for d in data:
+            # a single get() replaces the separate membership test and lookup
             for column in column_list:
-                if column in d:
-                    d[column] = query.sub(replace, d[column])
+                value = d.get(column)
+                if value is not None:
+                    d[column] = sub(replace, value)
                     n += 1
 
         return n
@@ -304,22 +792,31 @@ class Gff:
 
         :param old_key: str, current key
         :param new_key: str, new _key
-        :return: True if old_key exists
+        :return: True if old_key exists in any row
         -----------------------------------------------------------------------------------------"""
-        data = self.data
-        if old_key in data[0]:
-            for d in data:
+        self._idx.pop(old_key, None)
+        self._idx.pop(new_key, None)
+        renamed = False
+        for d in self.data:
+            # pop() then assignment is two dict operations, faster than copying the value and
+            # deleting the old key. rows without old_key, e.g. attributes missing from some
+            # features, are left unchanged
+            try:
                 d[new_key] = d.pop(old_key)
+                renamed = True
+            except KeyError:
+                continue
 
-            return True
-
-        return False
+        return renamed
 
     def position_to_int(self):
         """-----------------------------------------------------------------------------------------
-        convert begin and end positions from str to int
+        convert begin and end positions from str to int. feature_parse() already stores them as
+        int, so this is only needed for rows added or modified outside of Gff
         :return: 
         -----------------------------------------------------------------------------------------"""
+        self._idx.pop('begin', None)
+        self._idx.pop('end', None)
         for d in self.data:
             d['begin'] = int(d['begin'])
             d['end'] = int(d['end'])
@@ -327,30 +824,75 @@ class Gff:
         return True
 
 
+def _read_feature_range(path, begin, end, features, attr_sep, attributes):
+    """---------------------------------------------------------------------------------------------
+    Worker for Gff.read_feature() with multiple processes: parse the lines between byte offsets
+    begin and end of the file and return the rows for the selected features. begin and end must
+    be at line boundaries. The file is memory mapped and decoded in blocks of about Gff.read_size
+    bytes, so memory use does not grow with the size of the range.
+
+    :param path: str                path to GFF/GTF file
+    :param begin: int               offset of first byte
+    :param end: int                 offset of last byte + 1
+    :param features: frozenset      features to keep
+    :param attr_sep: str            attribute separator of the reading Gff object
+    :param attributes: bool         if False, do not split the attribute column, may also be
+                                    a frozenset of the attribute keys to keep
+    :return: list of Dotdict        parsed rows
+    ---------------------------------------------------------------------------------------------"""
+    gff = Gff()
+    gff.attr_sep = attr_sep
+
+    with open(path, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = begin
+        while pos < end:
+            # extend each block to the end of its last line
+            stop = min(pos + Gff.read_size, end)
+            if stop < end:
+                eol = mm.find(b'\n', stop - 1, end)
+                stop = end if eol == -1 else eol + 1
+
+            gff.gff_in = io.StringIO(mm[pos:stop].decode())
+            gff.read_feature(features, attributes)
+            pos = stop
+
+    return gff.data
+
+
 # ==================================================================================================
 # test
 # ==================================================================================================
 if __name__ == '__main__':
     genome = None
+    test_file = ''
+    test_mode = ''
     test_feature = ''
     test_value = ['', '']
-    test = {'gff':          False,
-            'gtf':          True,
-            'read_all':     True,
-            'read_feature': False,
-            'get_by_value': True,
-            'examples':     True}
+    test = {'gff':             False,
+            'gtf':             True,
+            'read_all':        True,
+            'read_feature':    False,
+            'get_by_value':    True,
+            'examples':        True,
+            'read_parallel':   True,
+            'cache':           True,
+            'replace_many':    True,
+            'attribute_parse': True}
 
     if test['gff']:
         # read gff, example is from CoGe comparative genomics
-        genome = Gff(file='data/genome.gff')
+        test_file = 'data/genome.gff'
+        test_mode = 'GFF'
+        genome = Gff(file=test_file)
         genome.attr_sep = '='
         test_feature = ['mRNA', 'exon']
         test_value = ['sequence', 'Ctg0001']
 
     if test['gtf']:
         # read gtf file, example is from stringtie, v2.0.3
-        genome = Gff(file='data/stringtie.gtf')
+        test_file = 'data/stringtie.gtf'
+        test_mode = 'GTF'
+        genome = Gff(file=test_file)
         genome.attr_sep = ' '
         test_feature = ['transcript']
         test_value = ['gene_id', 'MSTRG.1']
@@ -390,4 +932,52 @@ if __name__ == '__main__':
         for n, data in genome.get_by_feature(feature):
             print(f"sequence:{data['sequence']}\t{data['begin']}\t{data['end']}\t\t{data[geneid]}")
 
+    if test['read_parallel']:
+        # reading with several processes must give the same rows, in the same order, as one
+        serial = Gff(file=test_file, mode=test_mode)
+        serial.read_feature(test_feature)
+        parallel = Gff(file=test_file, mode=test_mode)
+        nline = parallel.read_feature(test_feature, workers=3)
+        same = parallel.data == serial.data
+        sys.stdout.write(f'read_parallel: {nline} features read with 3 workers, same as serial: '
+                         f'{same}\n')
+
+    if test['cache']:
+        # the first read writes the cache, the second loads it, both must match a plain read
+        import tempfile
+
+        plain = Gff(file=test_file, mode=test_mode)
+        plain.read_feature(test_feature)
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = os.path.join(tmp, 'test.cache')
+            for trial in ('written', 'loaded'):
+                cached = Gff(file=test_file, mode=test_mode)
+                nline = cached.read_feature(test_feature, cache=cache)
+                same = cached.data == plain.data
+                sys.stdout.write(f'cache {trial}: {nline} features, same as uncached: {same}\n')
+
+    if test['replace_many']:
+        # one pass with several pairs gives the same result as one replace_by_column per pair
+        pairs = [('lcl|', ''), ('Ctg', 'contig_')]
+        single = Gff(file=test_file, mode=test_mode)
+        single.read_all()
+        for find, replace in pairs:
+            single.replace_by_column('sequence', find, replace)
+        many = Gff(file=test_file, mode=test_mode)
+        many.read_all()
+        nline = many.replace_by_column_many('sequence', pairs)
+        same = many.data == single.data
+        sys.stdout.write(f'replace_many: {nline} rows, same as replace_by_column: {same}\n')
+
+    if test['attribute_parse']:
+        # reading without attributes and parsing them later gives the same rows as parsing them
+        # while reading
+        parsed = Gff(file=test_file, mode=test_mode)
+        parsed.read_all()
+        deferred = Gff(file=test_file, mode=test_mode)
+        deferred.read_all(attributes=False)
+        nline = deferred.attribute_parse()
+        same = deferred.data == parsed.data
+        sys.stdout.write(f'attribute_parse: {nline} rows parsed, same as read_all: {same}\n')
+
     exit(0)
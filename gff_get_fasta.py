@@ -49,7 +49,11 @@ if __name__ == '__main__':
     sys.stderr.write(f'\tFasta output file: {opt.output}\n\n')
 
     gff = Gff(file=opt.gff, mode='GFF')
-    gff.read_feature(['gene'])
+    # only the position and the unparsed attribute column are used
+    gff.read_feature(['gene'], attributes=False)
+    # index the genes by sequence once so each Fasta entry is a lookup rather than a scan of all
+    # genes
+    gff.index(['sequence'])
 
     fasta = Fasta(filename=opt.fasta)
     out = Fasta(filename=opt.output, mode='w')
@@ -0,0 +1,157 @@
+"""=================================================================================================
+interval.py
+
+contains IntervalIndex class, an index of feature intervals for overlap queries
+================================================================================================="""
+import sys
+from bisect import bisect_left, bisect_right
+from operator import itemgetter
+
+
+class IntervalIndex:
+    """=============================================================================================
+    Static index of the intervals in a list of Gff rows. Rows are partitioned by key, by default
+    (sequence, strand), and each partition stores the begin and end positions and row numbers as
+    parallel lists sorted by begin. Queries binary search for the first interval that could reach
+    the query, from the longest interval in the partition, and walk right until the intervals begin
+    after the query ends (the approach of Lapper/AIList style indices).
+
+    Positions are closed, as in GFF, so intervals that begin and end at the same base overlap.
+
+    For a series of queries in increasing begin order, seek() keeps a cursor per partition so each
+    query starts where the last one stopped instead of binary searching.
+    ============================================================================================="""
+
+    def __init__(self, rows=None, key=('sequence', 'strand')):
+        """-----------------------------------------------------------------------------------------
+        partition: dict, key value: {'begin': list, 'end': list, 'id': list, 'max_len': int}
+        key: tuple of str, columns used to partition the rows
+        cursor: dict, key value: [last query begin, index of first candidate], used by seek()
+
+        :param rows: list of dict       rows of a Gff object, e.g., gff.data
+        :param key: tuple of str        columns used to partition the rows
+        -----------------------------------------------------------------------------------------"""
+        self.partition = {}
+        self.key = tuple(key)
+        self.cursor = {}
+
+        if rows:
+            self.build(rows)
+
+    def build(self, rows):
+        """-----------------------------------------------------------------------------------------
+        Build the index from a list of rows, replacing any existing index. The stored ids are the
+        positions of the rows in the list.
+
+        :param rows: list of dict       rows with begin, end, and the key columns
+        :return: int                    number of intervals indexed
+        -----------------------------------------------------------------------------------------"""
+        key = self.key
+        group = {}
+        for n, row in enumerate(rows):
+            k = tuple(row[col] for col in key)
+            group.setdefault(k, []).append((row['begin'], row['end'], n))
+
+        self.partition = {}
+        self.cursor = {}
+        for k, intervals in group.items():
+            intervals.sort()
+            begin = [i[0] for i in intervals]
+            end = [i[1] for i in intervals]
+            self.partition[k] = {'begin':   begin,
+                                 'end':     end,
+                                 'id':      [i[2] for i in intervals],
+                                 'max_len': max(e - b for b, e in zip(begin, end))}
+
+        return len(rows)
+
+    def query(self, key, begin, end):
+        """-----------------------------------------------------------------------------------------
+        Generator for the ids of intervals in partition key that overlap begin to end
+
+        :param key: tuple       partition, values of the key columns, e.g., ('Ctg0001', '+')
+        :param begin: int       first base of query
+        :param end: int         last base of query
+        :yield: int             id (row number) of the next overlapping interval, in begin order
+        -----------------------------------------------------------------------------------------"""
+        part = self.partition.get(key)
+        if part is None:
+            return
+
+        p_begin = part['begin']
+        p_end = part['end']
+        p_id = part['id']
+        stop = bisect_right(p_begin, end)
+        for i in range(bisect_left(p_begin, begin - part['max_len']), stop):
+            if p_end[i] >= begin:
+                yield p_id[i]
+
+        return
+
+    def seek(self, key, begin, end):
+        """-----------------------------------------------------------------------------------------
+        Same as query(), but faster for queries sorted by begin. A query that begins before the
+        previous query in the same partition falls back to a binary search.
+
+        :param key: tuple       partition, values of the key columns, e.g., ('Ctg0001', '+')
+        :param begin: int       first base of query
+        :param end: int         last base of query
+        :yield: int             id (row number) of the next overlapping interval, in begin order
+        -----------------------------------------------------------------------------------------"""
+        part = self.partition.get(key)
+        if part is None:
+            return
+
+        p_begin = part['begin']
+        p_end = part['end']
+        p_id = part['id']
+        l_bound = begin - part['max_len']
+
+        cursor = self.cursor.get(key)
+        if cursor is None or begin < cursor[0]:
+            i = bisect_left(p_begin, l_bound)
+        else:
+            i = cursor[1]
+            n = len(p_begin)
+            while i < n and p_begin[i] < l_bound:
+                i += 1
+        self.cursor[key] = [begin, i]
+
+        n = len(p_begin)
+        while i < n and p_begin[i] <= end:
+            if p_end[i] >= begin:
+                yield p_id[i]
+            i += 1
+
+        return
+
+
+# ==================================================================================================
+# test
+# ==================================================================================================
+if __name__ == '__main__':
+    from gff import Gff
+
+    genome = Gff(file='data/genome.gff', mode='GFF')
+    genome.read_feature(['gene'])
+    genome.replace_by_column('sequence', 'lcl|', '')
+    index = IntervalIndex(genome.data)
+    sys.stdout.write(f'{len(genome.data)} genes indexed in {len(index.partition)} partitions\n')
+
+    transcripts = Gff(file='data/stringtie.gtf', mode='GTF')
+    transcripts.read_feature(['transcript'])
+    transcripts.replace_by_column('sequence', 'lcl|', '')
+    transcripts.data.sort(key=itemgetter('sequence', 'begin'))
+
+    for t in transcripts.data:
+        key = (t['sequence'], t['strand'])
+        found = list(index.query(key, t['begin'], t['end']))
+        sought = list(index.seek(key, t['begin'], t['end']))
+        if found != sought:
+            sys.stderr.write(f'query and seek differ for {t["transcript_id"]}\n')
+
+        genes = ' '.join(genome.data[n]['ID'] for n in found)
+        sys.stdout.write(f"{t['transcript_id']}\t{t['sequence']}{t['strand']}\t{t['begin']}\t"
+                         f"{t['end']}\t{genes}\n")
+
+    exit(0)
@@ -1,3 +1,4 @@
+from operator import attrgetter, itemgetter
 from gff import Gff
 
 class Bundle:
@@ -21,7 +22,8 @@ def make_bundle(gff,id_column='transcript_id'):
     bundle_list = []
     b_stop = 0
     sequence_old = ''
-    for t in sorted(gff.data, key=lambda k: (k['sequence'], int(k['begin']))):
+    # begin is already an int in rows read by Gff
+    for t in sorted(gff.data, key=itemgetter('sequence', 'begin')):
         id = t[id_column]
         begin = int(t['begin'])
         end = int(t['end'])
@@ -173,7 +175,7 @@ if __name__ == '__main__':
     set = []
     set_end = 0
     set_seq = ''
-    for b in sorted(ubundle+sbundle, key=lambda k: (k.sequence, k.begin)):
+    for b in sorted(ubundle+sbundle, key=attrgetter('sequence', 'begin')):
 
         if b.begin > set_end or b.sequence != set_seq:
             # new set
@@ -3,6 +3,8 @@ map stringtie transcripts to genome GFF file
 
 Michael Gribskov     13 February 2024
 ================================================================================================="""
+import io
+import csv
 import sys
 import datetime
 import argparse
@@ -30,48 +32,111 @@ def process_command_line():
                     help='output GFF file',
                     type=str,
                     default='combined.gtf')
+    cl.add_argument('-c', '--cache',
+                    help='save parsed input next to each input file (<input>.cache, JSON) and reuse '
+                         'it on later runs, anyone who can write the cache can change the rows read',
+                    action='store_true')
 
     return cl.parse_args()
 
 
-def seq_begin_sorter(data):
+def sequence_key(data, stranded=False):
     """---------------------------------------------------------------------------------------------
-    generator for gff object data ordered by sequence_id and begin position
+    integer sequence code for each row of data. Codes are assigned in the sorted order of the
+    sequence names, so sorting by code is the same as sorting by name. if stranded is True, the
+    sequence and strand codes are combined into one int so that each strand of a sequence has its
+    own code
+
+    :param data: gff object     gff data
+    :param stranded: bool       give each strand of a sequence a separate code
+    :return: list of int        code for each row in data
+    ---------------------------------------------------------------------------------------------"""
+    seq_code, _ = data.factorize('sequence')
+    if stranded:
+        strand_code, strands = data.factorize('strand')
+        n_strand = len(strands)
+        seq_code = [s * n_strand + t for s, t in zip(seq_code, strand_code)]
+
+    return seq_code
+
+
+def seq_begin_order(data, seq_key=None):
+    """---------------------------------------------------------------------------------------------
+    row numbers of gff object data ordered by sequence and begin position
+
+    Row numbers are sorted rather than the rows. The sequence names are replaced by integer codes
+    (see sequence_key()) and the rows are partitioned by code in one pass; since overlaps never
+    cross sequences, each partition is then sorted on begin alone, so every comparison is between
+    two plain ints and the partitions are smaller than the whole. The sort is stable, rows with
+    the same key keep their order in data.
+
+    When data holds several sources that are each already sorted, e.g., a genome GFF followed by a
+    stringtie GTF, list.sort() finds the sorted runs and merges them in C, so the combined rows do
+    not need to be sorted per source and merged separately.
 
     :param data: gff object     gff data to sort
-    :return: int for            index postion in gff.data
+    :param seq_key: list        sequence codes from sequence_key(), default is unstranded codes
+    :return: list of int        row numbers in sorted order
     ---------------------------------------------------------------------------------------------"""
-    data = data.data
-    for entry in sorted(data, key=lambda l: (l['sequence'], l['begin'])):
-        yield Dotdict(entry)
+    if seq_key is None:
+        seq_key = sequence_key(data)
+
+    partition = {}
+    for i, code in enumerate(seq_key):
+        rows = partition.get(code)
+        if rows is None:
+            partition[code] = [i]
+        else:
+            rows.append(i)
 
-    return
+    # each partition of row numbers is sorted by looking up its begin position
+    by_begin = data.columns(['begin'])['begin'].__getitem__
+    order = []
+    for code in sorted(partition):
+        rows = partition[code]
+        rows.sort(key=by_begin)
+        order += rows
 
+    return order
 
-def overlap(gen):
-    """---------------------------------------------------------------------------------------------
-    find overlapping regions in data. features that begin and end at the same base are considered to
-    overlap
 
-    :param gen: generator   provides one line of data at a time, use seq_begin_sorter()
-    :return: list           overlapping rows
+def overlap_indices(seq_key, begin, end, order=None):
+    """---------------------------------------------------------------------------------------------
+    generator for overlapping regions in data sorted by sequence and begin. A row is added to the
+    current region if it has the same sequence code and begins before the largest end in the
+    region. The columns are parallel lists of ints, and the rows are visited in the order given by
+    order, e.g., from seq_begin_order(), so the columns do not need to be sorted. Each region is
+    given as the first and last + 1 positions in order, so no list of rows is built for a region.
+
+    :param seq_key: list of int     sequence code of each row, see sequence_key()
+    :param begin: list of int       begin position of each row
+    :param end: list of int         end position of each row
+    :param order: list of int       row numbers in sorted order, default is the order of the lists
+    :yield: int, int                first and last + 1 position in order of the next region
     ---------------------------------------------------------------------------------------------"""
-    new = next(gen)
-    region = [new]
-    stop = new.end
-    sequence = new.sequence
-
-    for new in gen:
-        if new.sequence == sequence and new.begin < stop:
-            # add to current overlap region
-            region.append(new)
-            stop = max(stop, new.end)
+    if order is None:
+        order = range(len(seq_key))
+    n = len(order)
+    if not n:
+        return
+
+    # k is the position in order, i the row number in the columns
+    first = 0
+    i = order[0]
+    stop = end[i]
+    cur_seq = seq_key[i]
+    for k in range(1, n):
+        i = order[k]
+        if seq_key[i] == cur_seq and begin[i] < stop:
+            if end[i] > stop:
+                stop = end[i]
         else:
-            # start a new region
-            yield region
-            region = [new]
-            stop = new.end
-            sequence = new.sequence
+            yield first, k
+            first = k
+            stop = end[i]
+            cur_seq = seq_key[i]
+
+    yield first, n
 
     return
 
@@ -92,64 +157,89 @@ if __name__ == '__main__':
     # read both genes and transcripts into the same gff object
     # genome gff
     genome = Gff(file=opt.gff, mode='GFF')
-    n_genes = genome.read_feature(['gene'])
+    # only the IDs are used from the attributes
+    n_genes = genome.read_feature(['gene'], attributes=['ID'],
+                                  cache=f'{opt.gff}.cache' if opt.cache else '')
     sys.stderr.write(f'{n_genes} genes read from {opt.gff}\n')
 
     # stringtie gtf
     genome.open(opt.gtf)
     genome.setmode('GTF')
-    n_transcripts = genome.read_feature(['transcript'])
+    n_transcripts = genome.read_feature(['transcript'], attributes=['transcript_id'],
+                                        cache=f'{opt.gtf}.cache' if opt.cache else '')
     sys.stderr.write(f'{n_transcripts} transcripts read from {opt.gtf}\n')
 
-    # add attribute to data to store the source of the data
-    genome.attribute_add('source', 'GFF', 0, n_genes)
-    genome.attribute_add('source', 'GTF', n_genes, n_genes + n_transcripts)
-
-    # add the strand to the sequence name so that positive and negative strands will
-    # not be merged - kind of a kludge
-    for row in genome.data:
-        row['sequence'] = row['sequence'] + row['strand']
+    # add attribute to data to store the source of the data. attribute_add() treats end=0 as
+    # the end of data, so an empty range is skipped rather than passed
+    if n_genes:
+        genome.attribute_add('source', 'GFF', 0, n_genes)
+    if n_transcripts:
+        genome.attribute_add('source', 'GTF', n_genes, n_genes + n_transcripts)
 
     gff_template = Dotdict({'sequence': '', 'method': 'stringtie_to_genome', 'feature': 'gene',
                             'begin':    0, 'end': 0, 'score': '.', 'strand': '', 'frame': '.', 'attribute': ''})
 
-    out = open(opt.output, 'w')
-    g_order = seq_begin_sorter(genome)
+    # output and report are written as tab delimited rows through csv writers. nothing is quoted,
+    # a field containing a tab raises csv.Error rather than corrupting the output
+    out = open(opt.output, 'w', buffering=1 << 23, newline='')
+    out_writer = csv.writer(out, delimiter='\t', quoting=csv.QUOTE_NONE, quotechar=None,
+                            lineterminator='\n')
+    # positive and negative strands are sorted and merged separately
+    seq_key = sequence_key(genome, stranded=True)
+    order = seq_begin_order(genome, seq_key)
+    cols = genome.columns(['begin', 'end', 'source'])
+    begin = cols['begin']
+    end = cols['end']
+    source = cols['source']
+    # the ID of each row, from the ID attribute for genes and transcript_id for transcripts,
+    # selected once by row range rather than by testing the source of every row. the ranges are
+    # sliced directly, columns() would treat an empty range (0, 0) as all rows
+    row_id = [row.get('ID') for row in genome.data[:n_genes]] + \
+        [row.get('transcript_id') for row in genome.data[n_genes:n_genes + n_transcripts]]
+    # the group report is collected and written in blocks, stderr is line buffered so writing
+    # each line separately would flush once per row
+    report = io.StringIO()
+    report_writer = csv.writer(report, delimiter='\t', quoting=csv.QUOTE_NONE, quotechar=None,
+                               lineterminator='\n')
     n_overlap = 0
-    for group in overlap(g_order):
-        sys.stderr.write(f'overlap group {n_overlap}\n')
+    for first, last in overlap_indices(seq_key, begin, end, order):
+        report.write(f'overlap group {n_overlap}\n')
         n_overlap += 1
 
+        # groups never cross sequence or strand (seq_key is stranded), so the names are looked up
+        # once per group from its first row instead of for every row
+        entry = genome.data[order[first]]
+        sequence = entry.sequence
+        strand = entry.strand
+
         begin_min = sys.maxsize
         end_max = 0
         cluster_members = ''
-        entry = None
-        for entry in group:
-            if entry.source == 'GFF':
-                seqid = entry.ID
-            else:
-                seqid = entry.transcript_id
-
-            begin_min = min(entry.begin, begin_min)
-            end_max = max(entry.end, end_max)
+        for i in order[first:last]:
+            # str() so a missing ID is written as None in both the report and cluster_members,
+            # csv.writer would write None as an empty field
+            seqid = str(row_id[i])
+            i_begin = begin[i]
+            i_end = end[i]
+
+            begin_min = min(i_begin, begin_min)
+            end_max = max(i_end, end_max)
             cluster_members += f'ID={seqid};'
 
-            sys.stderr.write(f"{entry.sequence}\t{seqid}\t{entry.begin}\t{entry.end}\t{entry.strand}\t{entry.source}\n")
+            report_writer.writerow((sequence, seqid, i_begin, i_end, strand, source[i]))
 
         # write in GFF format
-        gff = Dotdict(gff_template.copy())
-        gff.sequence = entry.sequence[:-1]  # remove +/- added for sorting by strand
-        gff.begin = begin_min
-        gff.end = end_max
-        gff.strand = entry.strand
-        gff.attribute = cluster_members
-        line = ''
-        for field in Gff.column:
-            line += f'{gff[field]}\t'
-
-        out.write(f'{line.rstrip()}\n')
+        gff = dict(gff_template, sequence=sequence, begin=begin_min, end=end_max,
+                   strand=strand, attribute=cluster_members)
+        out_writer.writerow([gff[field] for field in Gff.column])
+
+        if report.tell() >= 1 << 16:
+            sys.stderr.write(report.getvalue())
+            report.seek(0)
+            report.truncate()
 
     # end of loop over overlapping groups
+    sys.stderr.write(report.getvalue())
     out.close()
 
     exit(0)